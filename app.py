@@ -1,3 +1,4 @@
+import os
 import sqlite3 as sl
 from collections import defaultdict
 
@@ -7,37 +8,53 @@ import networkx as nx
 import pandas as pd
 import plotly.express as px
 import streamlit as st
+import streamlit.components.v1 as components
 from pyvis.network import Network
 from streamlit_agraph import agraph, Node, Edge, Config
 
-from utils import codebook_loader, dta_to_table, load_questions
+from utils import (
+    codebook_loader,
+    data_to_table,
+    experts_to_tensor,
+    load_questions,
+    nan_euclidean_distances,
+    normalize_scores,
+    response_tensor,
+)
 
 
 @st.cache
-def initialize(db_path: str, codebook_path: str, dta1_path: str, dta2_path: str):
+def initialize(
+    db_path: str,
+    codebook_path: str,
+    data1_path: str,
+    data2_path: str,
+    tensor_path: str,
+):
     """Initialize the tables, etc.
 
     Args:
         db_path (str): sqlite database location
         codebook_path (str): `2019_CHES_codebook.pdf` location
-        dta1_path (str): `CHES2019V3.dta` location
-        dta2_path (str): `CHES2019_experts.dta` location
+        data1_path (str): `CHES2019V3.dta` or `CHES2019V3.csv` location
+        data2_path (str): `CHES2019_experts.dta` or `CHES2019_experts.csv` location
+        tensor_path (str): location to save the expert responses as `.npy`
 
     Returns:
-        pd.DataFrame: dataframe corresponding to `CHES2019V3.dta`
-        pd.DataFrame: dataframe corresponding to `CHES2019_experts.dta`
+        pd.DataFrame: dataframe corresponding to `CHES2019V3`
+        pd.DataFrame: dataframe corresponding to `CHES2019_experts`
     """
     # Save the tables
     con = sl.connect(db_path)
     cl = codebook_loader(con, codebook_path=codebook_path, skip_write_if_exist=False)
     cl.save_parties(if_exists="replace", table_name="PARTIES")
     cl.save_countries(if_exists="replace", table_name="COUNTRIES")
-    dta_to_table(
-        con, dta1_path, table_name="V3", skip_write_if_exist=False, if_exists="replace"
+    data_to_table(
+        con, data1_path, table_name="V3", skip_write_if_exist=False, if_exists="replace"
     )
-    dta_to_table(
+    data_to_table(
         con,
-        dta2_path,
+        data2_path,
         table_name="EXPERTS",
         skip_write_if_exist=False,
         if_exists="replace",
@@ -76,9 +93,32 @@ def initialize(db_path: str, codebook_path: str, dta1_path: str, dta2_path: str)
 
     df_questions = load_questions()
 
+    experts_to_tensor(
+        df_experts,
+        df_questions,
+        tensor_path,
+        source_paths=[codebook_path, data2_path, "data/questions.json"],
+    )
+
     return df_v3, df_experts, df_questions
 
 
+@st.cache(allow_output_mutation=True)
+def load_response_tensor(tensor_path: str, version: int) -> response_tensor:
+    """Memory-map the expert responses saved by `initialize`. The output is not
+    hashed or copied by streamlit, so all sessions share the same mapped pages.
+
+    Args:
+        tensor_path (str): `.npy` location of the expert responses
+        version (int): modification time of `tensor_path`, so the file is mapped
+            again after `initialize` rewrites it
+
+    Returns:
+        response_tensor
+    """
+    return response_tensor(tensor_path)
+
+
 def multiselect_content(
     df: pd.DataFrame,
     select_method: str,
@@ -200,6 +240,62 @@ def aggregate(
     return df_agg
 
 
+@st.cache
+def party_distances(
+    df_mean: pd.DataFrame, df_questions: pd.DataFrame, questions: list
+) -> pd.DataFrame:
+    """Distances between the parties, over the mean scores of the chosen questions.
+    Scores are normalized by the score range of each question, and questions
+    without a score for a party are left out of the distances of that party.
+
+    Args:
+        df_mean (pd.DataFrame): mean score of each party on each question
+        df_questions (pd.DataFrame): question metadata from `load_questions`
+        questions (list): questions to compare the parties on
+
+    Returns:
+        pd.DataFrame: distances between the parties
+                        | country |
+                        |   party |
+        ________________|
+        country | party |
+    """
+    X = normalize_scores(df_mean.loc[:, questions], df_questions).to_numpy()
+
+    return pd.DataFrame(
+        nan_euclidean_distances(X), index=df_mean.index, columns=df_mean.index
+    )
+
+
+@st.cache
+def network_layout(
+    df: pd.DataFrame, country_phrase: str, party_phrase: str, scale: int = 1000
+) -> dict:
+    """Compute fixed positions of the nodes in the country-party network. The
+    layout is computed once over all the countries and parties of the dataset, so
+    filtered subsets reuse the same positions.
+
+    Args:
+        df (pd.DataFrame): dataframe with all the countries and parties
+        country_phrase (str): chosen phrase to describe country
+        party_phrase (str): chosen phrase to describe party
+        scale (int, optional): size of the layout in pixels. Defaults to 1000.
+
+    Returns:
+        dict: {node: (x, y)}
+    """
+    G = nx.Graph()
+    G.add_edges_from(
+        df[[country_phrase, party_phrase]]
+        .dropna()
+        .drop_duplicates()
+        .itertuples(index=False)
+    )
+    pos = nx.spring_layout(G, seed=0, scale=scale)
+
+    return {node: (float(x), float(y)) for node, (x, y) in pos.items()}
+
+
 def main():
     st.set_page_config(
         page_title="CHES2019 Data Analysis",
@@ -220,15 +316,21 @@ def main():
 
         db_path = st.text_input("Database path", "data/ches-data.db")
         codebook_path = st.text_input("Codebook path", "data/2019_CHES_codebook.pdf")
-        dta1_path = st.text_input("DTA file 1 path", "data/CHES2019V3.dta")
-        dta2_path = st.text_input("DTA file 2 path", "data/CHES2019_experts.dta")
+        data1_path = st.text_input(
+            "Data file 1 path (dta or csv)", "data/CHES2019V3.csv"
+        )
+        data2_path = st.text_input(
+            "Data file 2 path (dta or csv)", "data/CHES2019_experts.csv"
+        )
+        tensor_path = st.text_input("Response tensor path", "data/ches-experts.npy")
 
         optional_country_selector = ["country_id", "country_fullname"]
         optional_party_selector = ["party_id", "party_name", "party_name_english"]
 
         df_v3, df_experts, df_questions = initialize(
-            db_path, codebook_path, dta1_path, dta2_path
+            db_path, codebook_path, data1_path, data2_path, tensor_path
         )
+        tensor = load_response_tensor(tensor_path, os.stat(tensor_path).st_mtime_ns)
 
         st.markdown("---")
 
@@ -330,8 +432,17 @@ def main():
                     st.json(df_questions_q.to_json())
 
         elif plot_args["detail_level"] == "more":
+            # Every party is a contiguous block of rows in the tensor
+            party_labels = df_p.groupby("party_id")[party_phrase].first()
             for q in selected_questions:
-                df = df_p.loc[:, [party_phrase, q]]
+                i = tensor.question(q)
+                df = pd.concat(
+                    [
+                        pd.DataFrame({party_phrase: label, q: tensor.party(pid)[:, i]})
+                        for pid, label in party_labels.items()
+                    ],
+                    ignore_index=True,
+                )
                 df_questions_q = df_questions.loc[q]
                 scores = [int(m) for m in df_questions_q.loc["scores"].keys()]
                 fig = px.box(
@@ -366,15 +477,62 @@ def main():
             config_sa = Config()
             agraph(nodes=nodes_sa, edges=edges_sa, config=config_sa)
         with st.expander("Relationship between countries and parties (pyvis)"):
+            layout = network_layout(df_experts, country_phrase, party_phrase)
             G = nx.DiGraph()
             G.add_edges_from(edges)
-            graph = Network(width="100%", height = "1000px")
-            graph.barnes_hut()
+            # Fixed positions computed on the server, so the browser doesn't need to
+            # simulate the layout
+            nx.set_node_attributes(
+                G,
+                {
+                    node: {"x": x, "y": y, "physics": False}
+                    for node, (x, y) in layout.items()
+                    if node in G
+                },
+            )
+            # Inline the js/css, the html is embedded and pyvis would copy them to lib/
+            graph = Network(width="100%", height = "1000px", cdn_resources="in_line")
             graph.from_nx(G)
+            graph.toggle_physics(False)
             graph.save_graph("c-p.html")
             HtmlFile = open("c-p.html", 'r', encoding='utf-8')
             source_code = HtmlFile.read()
-            st.components.v1.html(source_code, height = 1000)
+            components.html(source_code, height = 1000)
+        with st.expander("Similar parties across Europe"):
+            df_mean = aggregate(
+                df_experts,
+                country_phrase,
+                party_phrase,
+                dropped_columns=[
+                    "country",
+                    "party",
+                    *optional_country_selector,
+                    *optional_party_selector,
+                ],
+            ).xs("nanmean", axis=1, level="aggregation")
+            parties = list(df_mean.index)
+            party = st.selectbox(
+                "Party to compare",
+                parties,
+                index=parties.index(edges[0]) if len(edges) else 0,
+                format_func=lambda p: f"{p[1]} ({p[0]})",
+            )
+            k = st.number_input("Number of similar parties", 1, len(parties) - 1, 5)
+            compared_questions = st.multiselect(
+                "Questions to compare on",
+                sorted(df_mean.columns),
+                sorted(df_mean.columns),
+            )
+            if compared_questions:
+                df_dist = party_distances(df_mean, df_questions, compared_questions)
+                st.dataframe(
+                    df_dist.loc[party]
+                    .drop(party)
+                    .dropna()
+                    .nsmallest(k)
+                    .rename("distance")
+                    .reset_index()
+                )
         with st.expander("Detailes about questions"):
             st.json(df_questions.to_json())
 
@@ -0,0 +1,217 @@
+"""Load test for the streamlit app.
+
+Simulates concurrent sessions driving `app.py` headlessly through streamlit's app
+testing API, and reports the rerun latency percentiles, the peak RSS and the cache
+hit rates. All the sessions run in this process, so they share the caches the same
+way the sessions of one streamlit server do.
+
+The app testing API swaps a process-wide runtime for every run, so the harness runs
+one rerun at a time. The rerun latency is the time of the rerun itself. The time a
+rerun waited for the other sessions is reported separately. That wait comes from
+the harness, not from the app, and it grows with the number of sessions.
+
+Reruns which raise an exception are left out of the latencies, and the script exits
+with status 1 if there are any.
+
+Usage:
+    python load_test.py --sessions 8 --iterations 5
+"""
+import argparse
+import functools
+import random
+import resource
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+PLOT_OPTIONS = [
+    "Country Aggregation on each question",
+    "Detailed survey result (Finland)",
+]
+
+# `AppTest.run` is not thread-safe, see the module docstring
+_run_lock = threading.Lock()
+
+
+class cache_counter:
+    """Count calls and misses of the functions decorated by `st.cache`.
+
+    While active, `st.cache` is replaced by a decorator which wraps the original one.
+    The cache key of `st.cache` is built from the source of the decorated function,
+    which is still the original source since the wrapper keeps `__wrapped__`.
+
+    """
+
+    def __init__(self):
+        self.calls = defaultdict(int)
+        self.misses = defaultdict(int)
+        self._lock = threading.Lock()
+        self._original_cache = st.cache
+
+    def _count(self, counts: dict, name: str):
+        with self._lock:
+            counts[name] += 1
+
+    def cache(self, func=None, **kwargs):
+        if func is None:
+            return lambda f: self.cache(f, **kwargs)
+
+        name = func.__qualname__
+
+        @functools.wraps(func)
+        def body(*args, **kw):
+            self._count(self.misses, name)
+            return func(*args, **kw)
+
+        cached = self._original_cache(body, **kwargs)
+
+        @functools.wraps(func)
+        def call(*args, **kw):
+            self._count(self.calls, name)
+            return cached(*args, **kw)
+
+        return call
+
+    def __enter__(self):
+        st.cache = self.cache
+        return self
+
+    def __exit__(self, *exc):
+        st.cache = self._original_cache
+
+    def hit_rates(self) -> dict:
+        """Hit rate of each cached function, hits / calls"""
+        return {
+            name: (calls - self.misses[name]) / calls
+            for name, calls in self.calls.items()
+        }
+
+
+def _widget(widgets, label: str):
+    """Find a widget by its label"""
+    return next(w for w in widgets if w.label == label)
+
+
+def run_session(
+    session: int, iterations: int, seed: int, script_path: str, timeout: float
+) -> tuple[list[float], list[float], list[str]]:
+    """Drive one app session: switch between the plot options, change the country,
+    party and question selections and press "Plot!".
+
+    Args:
+        session (int): session number, used to seed the random choices
+        iterations (int): how many times to go through the interactions
+        seed (int): random seed
+        script_path (str): streamlit app to test
+        timeout (float): timeout for a single rerun in seconds
+
+    Returns:
+        list: latency of each successful rerun in seconds
+        list: time each successful rerun waited for the other sessions in seconds
+        list: messages of the exceptions raised by the failed reruns
+    """
+    rng = random.Random(seed + session)
+    at = AppTest.from_file(script_path, default_timeout=timeout)
+    latencies = []
+    waits = []
+    errors = []
+
+    def _rerun():
+        start = time.perf_counter()
+        with _run_lock:
+            acquired = time.perf_counter()
+            at.run()
+            stop = time.perf_counter()
+        if at.exception:
+            errors.append(at.exception[0].message)
+        else:
+            latencies.append(stop - acquired)
+            waits.append(acquired - start)
+
+    _rerun()
+    for i in range(iterations):
+        if errors:
+            break
+
+        plot_option = PLOT_OPTIONS[(session + i) % len(PLOT_OPTIONS)]
+        _widget(at.selectbox, "How would you like to plot?").set_value(plot_option)
+        _rerun()
+
+        for label in ["Choose country", "Choose party", "Choose question"]:
+            multiselect = _widget(at.multiselect, label)
+            options = multiselect.options
+            selected = rng.sample(options, k=min(len(options), rng.randint(1, 3)))
+            multiselect.set_value(selected)
+            _rerun()
+
+        _widget(at.button, "Plot!").click()
+        _rerun()
+
+    return latencies, waits, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sessions", type=int, default=8, help="concurrent sessions")
+    parser.add_argument(
+        "--iterations", type=int, default=5, help="interaction rounds per session"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--script", default="app.py", help="streamlit app to test")
+    parser.add_argument(
+        "--timeout", type=float, default=600, help="timeout of a rerun in seconds"
+    )
+    args = parser.parse_args()
+
+    with cache_counter() as counter:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.sessions) as executor:
+            results = list(
+                executor.map(
+                    lambda s: run_session(
+                        s, args.iterations, args.seed, args.script, args.timeout
+                    ),
+                    range(args.sessions),
+                )
+            )
+        wall_time = time.perf_counter() - start
+
+    latencies = np.array([t for session, _, _ in results for t in session])
+    waits = np.array([t for _, session, _ in results for t in session])
+    errors = [e for _, _, session in results for e in session]
+    # ru_maxrss is in kilobytes on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    print(f"sessions:          {args.sessions}")
+    print(f"successful reruns: {len(latencies)}")
+    print(f"failed reruns:     {len(errors)}")
+    print(f"wall time:         {wall_time:.1f} s")
+    if len(latencies):
+        for name, times in [("rerun latency", latencies), ("harness wait", waits)]:
+            p50, p95, p99 = np.percentile(times, [50, 95, 99]) * 1000
+            print(
+                f"{name + ':':<19}p50 {p50:.0f} ms, p95 {p95:.0f} ms, "
+                f"p99 {p99:.0f} ms"
+            )
+    print(f"peak RSS:          {peak_rss:.0f} MB")
+    print("cache hit rates:")
+    for name, hit_rate in sorted(counter.hit_rates().items()):
+        print(f"  {name}: {hit_rate:.1%} of {counter.calls[name]} calls")
+
+    if errors:
+        print(
+            f"\n{len(errors)} reruns raised an exception, the first one was:\n"
+            f"{errors[0]}",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -21,6 +21,7 @@ setup(
         "isort",
         "graphviz",
         "plotly",
+        "pyarrow",
         "pyvis",
         "streamlit",
         "streamlit_agraph"
@@ -0,0 +1,69 @@
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils import experts_to_tensor, load_questions, response_tensor
+
+pytestmark = pytest.mark.unit
+
+
+def test_response_tensor_slices_match_experts():
+    """Test the country and party slices of the response tensor are views of the
+    mapped file, and have the same responses as the experts dataframe
+    """
+    df_questions = load_questions()
+    df_e = pd.DataFrame(
+        {
+            "country": ["fin", "be", "fin", "be", "fin"],
+            "party_id": [1402.0, 102.0, 1401.0, 102.0, 1402.0],
+            "eu_position": [7.0, 6.0, np.nan, 5.0, 4.0],
+            "lrgen": [3.0, 2.0, 8.0, 1.0, 0.0],
+        }
+    )
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tensor_path = Path(tmpdir) / "experts.npy"
+        experts_to_tensor(df_e, df_questions, tensor_path)
+        tensor = response_tensor(tensor_path)
+
+        i = tensor.question("eu_position")
+        country = tensor.country("fin")
+        party = tensor.party(1402)
+
+        assert set(tensor.questions) == {"eu_position", "lrgen"}
+        assert list(tensor.countries) == ["be", "fin"]
+        assert list(tensor.party_ids) == [102, 1401, 1402]
+        assert np.shares_memory(country, tensor.values)
+        assert np.shares_memory(party, tensor.values)
+        np.testing.assert_array_equal(country[:, i], [np.nan, 7.0, 4.0])
+        np.testing.assert_array_equal(party[:, i], [7.0, 4.0])
+        np.testing.assert_array_equal(tensor.party(102)[:, i], [6.0, 5.0])
+
+
+def test_response_tensor_only_rewritten_when_sources_change():
+    """Test the tensor file is kept while its source files are unchanged, so the
+    processes keep mapping the same file
+    """
+    df_questions = load_questions()
+    df_e = pd.DataFrame(
+        {"country": ["fin"], "party_id": [1402.0], "eu_position": [7.0]}
+    )
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tensor_path = Path(tmpdir) / "experts.npy"
+        source_path = Path(tmpdir) / "experts.csv"
+        source_path.write_text("")
+
+        experts_to_tensor(df_e, df_questions, tensor_path, source_paths=[source_path])
+        inode = tensor_path.stat().st_ino
+        experts_to_tensor(df_e, df_questions, tensor_path, source_paths=[source_path])
+        assert tensor_path.stat().st_ino == inode
+
+        os.utime(source_path, ns=(0, 0))
+        experts_to_tensor(df_e, df_questions, tensor_path, source_paths=[source_path])
+        assert tensor_path.stat().st_ino != inode
+        assert list(Path(tmpdir).glob("*.tmp")) == []
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils import load_questions, nan_euclidean_distances, normalize_scores
+
+pytestmark = pytest.mark.unit
+
+
+def test_normalize_scores_to_question_range():
+    """Test scores are scaled to [0, 1] by the score range in questions.json"""
+    df_q = load_questions()
+    df = pd.DataFrame({"eu_position": [1.0, 4.0, 7.0], "lrgen": [0.0, np.nan, 10.0]})
+
+    df_n = normalize_scores(df, df_q)
+
+    np.testing.assert_allclose(df_n["eu_position"], [0.0, 0.5, 1.0])
+    np.testing.assert_allclose(df_n["lrgen"], [0.0, np.nan, 1.0])
+
+
+def test_nan_euclidean_distances():
+    """Test distances only use the coordinates present in both rows, and are the
+    plain Euclidean distances without NaNs
+    """
+    X = np.array(
+        [
+            [0.0, 0.0, 0.0],
+            [3.0, 4.0, 0.0],
+            [np.nan, 4.0, np.nan],
+            [1.0, np.nan, np.nan],
+        ]
+    )
+
+    distances = nan_euclidean_distances(X, block_size=3)
+
+    np.testing.assert_allclose(distances[0, 1], 5.0)
+    np.testing.assert_allclose(distances[0, 2], np.sqrt(3 * 16))
+    np.testing.assert_allclose(distances[1, 2], 0.0)
+    np.testing.assert_allclose(distances, distances.T)
+    assert np.isnan(distances[2, 3])
+    np.testing.assert_allclose(np.diag(distances), 0.0, atol=1e-12)
@@ -6,7 +6,13 @@ from pathlib import Path
 import pandas as pd
 import pytest
 
-from utils import codebook_loader, dta_to_table, load_questions
+from utils import (
+    codebook_loader,
+    data_to_table,
+    dta_to_table,
+    load_questions,
+    read_data,
+)
 
 pytestmark = pytest.mark.unit
 
@@ -99,3 +105,37 @@ def test_questions_json_joinable():
     )
 
     assert set(df_s["question"].unique()).issubset(df_q.index.unique())
+
+
+@pytest.mark.parametrize("file_name", ["CHES2019V3", "CHES2019_experts"])
+def test_csv_and_dta_tables_identical(file_name):
+    """Test loading the csv file gives the same SQL table as loading the dta file"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = Path(tmpdir) / "test.db"
+        con = sl.connect(db_path)
+
+        data_to_table(con, f"data/{file_name}.dta", table_name="DTA")
+        data_to_table(con, f"data/{file_name}.csv", table_name="CSV")
+
+        df_dta = pd.read_sql("""
+            SELECT *
+            FROM DTA
+        """, con, index_col="index")
+        df_csv = pd.read_sql("""
+            SELECT *
+            FROM CSV
+        """, con, index_col="index")
+
+    pd.testing.assert_frame_equal(df_csv, df_dta)
+
+
+def test_csv_country_labels_with_missing_country():
+    """Test country codes are mapped to labels even when some countries are missing"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        csv_path = Path(tmpdir) / "CHES2019V3.csv"
+        csv_path.write_text("country,party,party_id\n14,KOK,1402\n,SDP,1401\n")
+
+        df = read_data(str(csv_path))
+
+    assert df["country"].iloc[0] == "fin"
+    assert pd.isna(df["country"].iloc[1])
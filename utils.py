@@ -1,8 +1,13 @@
+import os
 import sqlite3 as sl
+import tempfile
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
 import tabula
+from pyarrow import csv as pa_csv
 
 
 class codebook_loader:
@@ -156,18 +161,135 @@ class codebook_loader:
         return
 
 
-def dta_to_table(
+# Value labels of the `country` column in `CHES2019V3.dta`, the csv file only has the
+# numeric codes
+COUNTRY_LABELS = {
+    1: "be",
+    2: "dk",
+    3: "ge",
+    4: "gr",
+    5: "esp",
+    6: "fr",
+    7: "irl",
+    8: "it",
+    10: "nl",
+    11: "uk",
+    12: "por",
+    13: "aus",
+    14: "fin",
+    16: "sv",
+    20: "bul",
+    21: "cz",
+    22: "est",
+    23: "hun",
+    24: "lat",
+    25: "lith",
+    26: "pol",
+    27: "rom",
+    28: "slo",
+    29: "sle",
+    31: "cro",
+    34: "tur",
+    35: "nor",
+    36: "swi",
+    37: "mal",
+    38: "lux",
+    40: "cyp",
+    45: "ice",
+}
+
+# Columns of `CHES2019_experts` named differently from `questions.json`
+EXPERTS_RENAMES = {
+    "party_name": "party",
+    "immigra_salience": "immigrate_salience",
+    "position": "eu_position",
+}
+
+# Types of the csv columns which are not questions. Numbers are read as float32, the
+# same as they are stored in the dta files.
+CSV_COLUMN_TYPES = {
+    "country": pa.int32(),  # numeric code, see COUNTRY_LABELS
+    "eastwest": pa.float32(),
+    "id": pa.float32(),
+    "party": pa.string(),
+    "party_name": pa.string(),
+    "party_id": pa.float32(),
+    "party_a_econ": pa.float32(),
+    "party_b_econ": pa.float32(),
+    "party_c_econ": pa.float32(),
+    "gender": pa.float32(),
+    "dob": pa.float32(),
+    "lrecon_self": pa.float32(),
+    "galtan_self": pa.float32(),
+    "cname": pa.string(),
+    "eu_position_sd": pa.float32(),
+    "lrecon_sd": pa.float32(),
+    "galtan_sd": pa.float32(),
+}
+
+
+def read_data(data_path: str, json_path: str = "data/questions.json") -> pd.DataFrame:
+    """Read a CHES data file to a dataframe, the format is detected from the file
+    suffix.
+
+    Stata files are read with `pd.read_stata`. Csv files are read with the
+    multi-threaded pyarrow reader, with column types taken from the question list and
+    `CSV_COLUMN_TYPES`, so that the result is the same as reading the dta file.
+
+    Args:
+        data_path (str): `.dta` or `.csv` file path to load
+        json_path (str, optional): path for `questions.json`, used for the csv column
+            types, default "data/questions.json"
+
+    Returns:
+        pd.DataFrame
+    """
+    suffix = Path(data_path).suffix.lower()
+
+    if suffix == ".dta":
+        return pd.read_stata(data_path)
+
+    elif suffix == ".csv":
+        questions = list(load_questions(json_path).index)
+        questions += [k for k, v in EXPERTS_RENAMES.items() if v in questions]
+        column_types = {
+            **{q: pa.float32() for q in questions},
+            **CSV_COLUMN_TYPES,
+        }
+        table = pa_csv.read_csv(
+            data_path,
+            read_options=pa_csv.ReadOptions(use_threads=True),
+            convert_options=pa_csv.ConvertOptions(
+                column_types=column_types,
+                # ".d" is Stata's "don't know" missing value
+                null_values=["", ".d"],
+            ),
+        )
+        df = table.to_pandas()
+        # A country column with nulls comes back as float64 instead of int32
+        if "country" in df and pd.api.types.is_numeric_dtype(df["country"]):
+            df["country"] = df["country"].map(COUNTRY_LABELS)
+        return df
+
+    else:
+        raise Exception(
+            f"File format: {suffix} not recognised.\n"
+            "Please use a file from {'.dta', '.csv'}"
+        )
+
+
+def data_to_table(
     sql_con: sl.Connection,
-    dta_path: str,
+    data_path: str,
     table_name: str,
     skip_write_if_exist: bool = True,
     if_exists: str = "fail",
 ):
-    """Load csv data as SQL database table.
+    """Load dta or csv data as SQL database table.
 
     Args:
         sql_con (s1.Connection): SQL connection to a database
-        dta_path (str): dta file path to load
+        data_path (str): dta or csv file path to load
         table_name (str): SQL table name to save
         skip_write_if_exist (bool, optional): default True = skip write if table
             exists in the db
@@ -179,10 +301,10 @@ def dta_to_table(
     if pd.io.sql.has_table(table_name, sql_con) and skip_write_if_exist:
         pass
     else:
-        df = pd.read_stata(dta_path)
+        df = read_data(data_path)
 
         # Cleaning up the data and unify column name
-        if "CHES2019_experts" in dta_path:
+        if "CHES2019_experts" in data_path:
             df = df.drop(
                 columns={
                     "id",  # related to questionnaire
@@ -200,13 +322,7 @@ def dta_to_table(
                     "gender",  # don't know what this is
                 }
             )
-            df = df.rename(
-                columns={
-                    "party_name": "party",
-                    "immigra_salience": "immigrate_salience",
-                    "position": "eu_position",
-                }
-            )
+            df = df.rename(columns=EXPERTS_RENAMES)
 
             # Change Party ID of Fratelli d’Italia to 844, same as other tables
             df["party_id"] = df["party_id"].replace(to_replace=843, value=844)
@@ -217,6 +333,23 @@ def dta_to_table(
         df.to_sql(table_name, sql_con, if_exists=if_exists)
 
 
+def dta_to_table(
+    sql_con: sl.Connection,
+    dta_path: str,
+    table_name: str,
+    skip_write_if_exist: bool = True,
+    if_exists: str = "fail",
+):
+    """Load dta data as SQL database table, see `data_to_table`."""
+    data_to_table(
+        sql_con,
+        dta_path,
+        table_name,
+        skip_write_if_exist=skip_write_if_exist,
+        if_exists=if_exists,
+    )
+
+
 def load_questions(json_path: str = "data/questions.json") -> pd.DataFrame:
     """Load json with question metadata to a dataframe, also does necessary cleanup.
 
@@ -231,3 +364,193 @@ def load_questions(json_path: str = "data/questions.json") -> pd.DataFrame:
     df_q = pd.read_json(json_path).T
     df_q.index = df_q.index.str.lower()
     return df_q
+
+
+def experts_to_tensor(
+    df_experts: pd.DataFrame,
+    df_questions: pd.DataFrame,
+    tensor_path: str = "data/ches-experts.npy",
+    source_paths: list = [],
+    skip_write_if_exist: bool = True,
+):
+    """Save expert responses as a dense (expert row x question) float32 array.
+
+    Rows are sorted by country and then by party_id, so that every country and every
+    party is a contiguous block of rows. The array is saved as `tensor_path` and the
+    row offsets of countries and parties are saved next to it with a `.npz` suffix,
+    together with a stamp of the paths and modification times of `source_paths`.
+
+    The files are only written when they are missing or their stamp is outdated, so
+    the processes on a host keep mapping the same file. They are replaced
+    atomically, so processes that already mapped the old files keep a consistent
+    view.
+
+    Args:
+        df_experts (pd.DataFrame): expert responses, with `country` and `party_id`
+            columns
+        df_questions (pd.DataFrame): question metadata from `load_questions`
+        tensor_path (str, optional): `.npy` file to write, default
+            "data/ches-experts.npy"
+        source_paths (list, optional): files the expert responses are loaded from.
+            Defaults to [].
+        skip_write_if_exist (bool, optional): default True = skip write if the files
+            exist and are up to date with `source_paths`
+    """
+    tensor_path = Path(tensor_path).absolute()
+    index_path = tensor_path.with_suffix(".npz")
+    stamp = np.array(
+        [f"{Path(p).absolute()}:{os.stat(p).st_mtime_ns}" for p in source_paths],
+        dtype=str,
+    )
+
+    if skip_write_if_exist and tensor_path.exists() and index_path.exists():
+        with np.load(index_path) as index:
+            if "stamp" in index and np.array_equal(index["stamp"], stamp):
+                return
+
+    questions = [q for q in df_questions.index if q in df_experts.columns]
+
+    df = df_experts.sort_values(["country", "party_id"], kind="mergesort")
+    values = df[questions].to_numpy(dtype=np.float32)
+    countries = df["country"].to_numpy(dtype=str)
+    party_ids = df["party_id"].to_numpy(dtype=np.int64)
+
+    # Row offsets of each block, the block i spans rows offsets[i]:offsets[i + 1]
+    country_starts = np.flatnonzero(np.r_[True, countries[1:] != countries[:-1]])
+    party_starts = np.flatnonzero(np.r_[True, party_ids[1:] != party_ids[:-1]])
+
+    def _replace(path: Path, save, *args, **kwargs):
+        # Unique temporary file, as sessions of the same process may write together
+        with tempfile.NamedTemporaryFile(
+            dir=path.parent, prefix=f"{path.name}.", suffix=".tmp", delete=False
+        ) as f:
+            save(f, *args, **kwargs)
+        os.replace(f.name, path)
+
+    # The index is written last, so an up-to-date stamp means the array is written
+    _replace(tensor_path, np.save, values)
+    _replace(
+        index_path,
+        np.savez,
+        stamp=stamp,
+        questions=np.array(questions),
+        countries=countries[country_starts],
+        country_offsets=np.r_[country_starts, len(df)],
+        party_ids=party_ids[party_starts],
+        party_offsets=np.r_[party_starts, len(df)],
+    )
+
+
+class response_tensor:
+    """Read-only view of the expert responses saved by `experts_to_tensor`.
+
+    The array is memory-mapped, so all the processes on a host share the same pages
+    and every country or party selection is a zero-copy slice.
+
+    Args:
+        tensor_path (str, optional): `.npy` file written by `experts_to_tensor`,
+            default "data/ches-experts.npy"
+
+    """
+
+    def __init__(self, tensor_path: str = "data/ches-experts.npy"):
+        self.tensor_path = Path(tensor_path).absolute()
+        self.values = np.load(self.tensor_path, mmap_mode="r")
+
+        with np.load(self.tensor_path.with_suffix(".npz")) as index:
+            self.questions = index["questions"]
+            self.countries = index["countries"]
+            self.country_offsets = index["country_offsets"]
+            self.party_ids = index["party_ids"]
+            self.party_offsets = index["party_offsets"]
+
+        self._question_pos = {q: i for i, q in enumerate(self.questions)}
+        self._country_pos = {c: i for i, c in enumerate(self.countries)}
+        self._party_pos = {p: i for i, p in enumerate(self.party_ids)}
+
+    def question(self, question: str) -> int:
+        """Column of a question in `values`."""
+        return self._question_pos[question]
+
+    def country(self, country: str) -> np.ndarray:
+        """Responses of all the experts on parties from a country.
+
+        Args:
+            country (str): country abbreviation, e.g. "fin"
+
+        Returns:
+            np.ndarray: (expert row x question) view of `values`
+        """
+        i = self._country_pos[country]
+        return self.values[self.country_offsets[i] : self.country_offsets[i + 1]]
+
+    def party(self, party_id: int) -> np.ndarray:
+        """Responses of all the experts on a party.
+
+        Args:
+            party_id (int): party id, e.g. 1402
+
+        Returns:
+            np.ndarray: (expert row x question) view of `values`
+        """
+        i = self._party_pos[int(party_id)]
+        return self.values[self.party_offsets[i] : self.party_offsets[i + 1]]
+
+
+def normalize_scores(df: pd.DataFrame, df_questions: pd.DataFrame) -> pd.DataFrame:
+    """Scale the scores of each question to [0, 1] using the score range of the
+    question in `questions.json`.
+
+    Args:
+        df (pd.DataFrame): dataframe with questions as columns
+        df_questions (pd.DataFrame): question metadata from `load_questions`
+
+    Returns:
+        pd.DataFrame: dataframe with the same shape as `df`
+    """
+    scores = df_questions.loc[df.columns, "scores"].map(
+        lambda s: [int(m) for m in s.keys()]
+    )
+    low = scores.map(min).astype(float)
+    high = scores.map(max).astype(float)
+
+    return (df - low) / (high - low)
+
+
+def nan_euclidean_distances(X: np.ndarray, block_size: int = 1024) -> np.ndarray:
+    """Pairwise Euclidean distances between the rows of `X`, ignoring NaNs.
+
+    Only the coordinates present in both rows are used, and the distance is scaled up
+    by the share of coordinates used, i.e. sqrt(n / n_common * sum((x - y) ** 2)).
+    The distance is NaN when two rows have no coordinates in common. Rows are
+    processed in blocks to limit the memory use.
+
+    Args:
+        X (np.ndarray): (row x coordinate) array
+        block_size (int, optional): rows per block. Defaults to 1024.
+
+    Returns:
+        np.ndarray: (row x row) distances
+    """
+    X = np.asarray(X, dtype=np.float64)
+    present = (~np.isnan(X)).astype(np.float64)
+    X0 = np.nan_to_num(X)
+    X0_sq = X0**2
+
+    distances = np.empty((len(X), len(X)))
+    for start in range(0, len(X), block_size):
+        stop = start + block_size
+        # sum((x - y) ** 2) = sum(x ** 2) - 2 * sum(x * y) + sum(y ** 2), over the
+        # coordinates present in both x and y
+        squared = (
+            X0_sq[start:stop] @ present.T
+            - 2 * X0[start:stop] @ X0.T
+            + present[start:stop] @ X0_sq.T
+        )
+        common = present[start:stop] @ present.T
+        with np.errstate(divide="ignore", invalid="ignore"):
+            squared = np.clip(squared, 0, None) * X.shape[1] / common
+        squared[common == 0] = np.nan
+        distances[start:stop] = np.sqrt(squared)
+
+    return distances